@@ -82,6 +82,10 @@ class AgentCommand(BaseModel):
     target: str = Field(..., description="The ID of the device or entity to act upon.")
     params: Dict[str, Any] = Field({}, description="A dictionary of parameters for the action.")
 
+# Built once at import so prompt builders and command pre-filters can share them.
+AGENT_COMMAND_JSON_SCHEMA = AgentCommand.model_json_schema()
+AGENT_COMMAND_FIELDS = frozenset(AgentCommand.model_fields)
+
 class SystemResponse(BaseModel):
     """
     Schema for responses sent by the system to the agent.
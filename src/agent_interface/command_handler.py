@@ -3,6 +3,8 @@ import json
 import logging
 from typing import Dict, Any, Optional
 
+import orjson
+
 from config.schemas import AgentCommand, SystemResponse
 from config.topics import AGENT_COMMANDS_TOPIC, AGENT_RESPONSES_TOPIC
 from src.utils.mqtt_client import MQTTClient
@@ -37,7 +39,7 @@ class CommandHandler:
         """
         try:
             # Parse JSON payload
-            command_data = json.loads(payload.decode('utf-8'))
+            command_data = orjson.loads(payload)
             
             try:
                 # Validate using Pydantic schema
@@ -3,6 +3,8 @@ import json
 import logging
 from typing import Dict, Any, Optional
 
+import orjson
+
 from config.schemas import AgentCommand, SystemResponse
 from src.utils.mqtt_client import MQTTClient
 from src.utils.topic_manager import TopicManager
@@ -47,7 +49,7 @@ class MultiLineCommandHandler:
             # device_id is now expected in the command payload's target field
             
             # Parse JSON payload
-            command_data = json.loads(payload.decode('utf-8'))
+            command_data = orjson.loads(payload)
             
             try:
                 # Validate using Pydantic schema
@@ -5,33 +5,52 @@ LLM Factory Agent 基础类
 """
 
 import asyncio
-import json
 import logging
 import time
-from typing import Dict, List, Optional, Any
+from collections import deque
+from typing import Deque, Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, field
 
+import orjson
+
 from src.utils.mqtt_client import MQTTClient
 from src.utils.topic_manager import TopicManager
 from config.schemas import AgentCommand
-from .state_collector import StateCollector
+from config.settings import AGENT_CONTEXT_LENGTH
+from .state_collector import StateCollector, LINES
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# 每条生产线上的设备ID
+AGVS = ("AGV_1", "AGV_2")
+STATIONS = ("StationA", "StationB", "StationC", "QualityCheck")
+CONVEYORS = ("Conveyor_AB", "Conveyor_BC", "Conveyor_CQ")
+WAREHOUSES = ("RawMaterial", "Warehouse")
+
+# orjson直接解析bytes，省去decode步骤
+_loads = orjson.loads
+
+# 预取AgentCommand的校验器/序列化器，避免每次发送都走classmethod分发
+_CMD_VALIDATOR = AgentCommand.__pydantic_validator__
+_CMD_SERIALIZER = AgentCommand.__pydantic_serializer__
+
+# 分发循环每轮最多处理的消息数
+_DISPATCH_BATCH = 64
+
+@dataclass(slots=True)
 class AgentState:
     """智能体状态管理"""
     current_time: float = 0.0
-    factory_state: Dict[str, Any] = field(default_factory=dict)
-    recent_events: List[str] = field(default_factory=list)
+    last_order_rate: float = 0.0  # 上次记录的订单完成率
+    warehouse_buffer_counts: Dict[str, int] = field(default_factory=dict)  # warehouse_id -> 库存数量
+    recent_events: Deque[str] = field(default_factory=lambda: deque(maxlen=AGENT_CONTEXT_LENGTH))
     last_decision_time: float = 0.0
     decision_interval: float = 5.0  # 决策间隔秒数
     
     def add_event(self, event: str):
-        """添加新事件，保持最近30条"""
+        """添加新事件，保持最近AGENT_CONTEXT_LENGTH条"""
+        self.current_time = time.time()
         self.recent_events.append(f"[{self.current_time:.1f}] {event}")
-        if len(self.recent_events) > 30:
-            self.recent_events = self.recent_events[-30:]
 
 class LLMFactoryAgent:
     """
@@ -63,7 +82,40 @@ class LLMFactoryAgent:
         self.running = False
         self.tasks = []
         
-        logger.info(f"LLM Factory Agent initialized with topic root: {topic_root}")
+        # MQTT消息收件箱：paho网络线程只负责入队，解析和处理在事件循环中完成
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inbox: Optional[asyncio.Queue] = None
+        # 每处理完一批消息置位，供测试或监控等待新数据而无需轮询
+        self.batch_ready = asyncio.Event()
+        # 每完成一次决策置位
+        self.decision_made = asyncio.Event()
+        
+        # 预计算topic字符串：命令topic按生产线缓存，订阅topic与路由表共用同一组字符串
+        self._cmd_topics = {
+            line_id: self.topic_manager.get_agent_command_topic(line_id)
+            for line_id in LINES
+        }
+        self._route: Dict[str, Any] = self._build_route()
+        # 设备状态topic发布的是完整快照，同一批次内连续重复的快照只需处理一次
+        snapshot_handlers = (self._handle_agv_status, self._handle_station_status,
+                             self._handle_conveyor_status, self._handle_warehouse_status)
+        self._snapshot_topics = frozenset(
+            topic for topic, handler in self._route.items() if handler in snapshot_handlers
+        )
+        
+        # 预计算AGV取货决策用到的 (line_id, [(agv_id, agv_key), ...]) 及命令模板
+        self._agv_slots = tuple(
+            (line_id, tuple((agv_id, f"{line_id}_{agv_id}") for agv_id in AGVS))
+            for line_id in LINES
+        )
+        self._pickup_command_template = {
+            "command_id": None,
+            "action": "move",
+            "target": None,
+            "params": {"target_point": "P0"}
+        }
+        
+        logger.info("LLM Factory Agent initialized with topic root: %s", topic_root)
     
     async def start(self):
         """启动智能体"""
@@ -73,14 +125,18 @@ class LLMFactoryAgent:
         self.mqtt_client.connect()
         await self._wait_for_mqtt_connection()
         
+        # 订阅前准备好收件箱，避免丢失订阅后立即到达的消息
+        self._loop = asyncio.get_running_loop()
+        self._inbox = asyncio.Queue()
+        
         # 订阅所有相关topics
         self._subscribe_topics()
         
         # 启动后台任务
         self.running = True
         self.tasks = [
-            asyncio.create_task(self._decision_loop()),
-            asyncio.create_task(self._state_update_loop())
+            asyncio.create_task(self._dispatch_loop()),
+            asyncio.create_task(self._decision_loop())
         ]
         
         logger.info("LLM Factory Agent started successfully")
@@ -115,44 +171,104 @@ class LLMFactoryAgent:
             await asyncio.sleep(0.1)
         logger.info("MQTT connection established")
     
-    def _subscribe_topics(self):
-        """订阅所有相关MQTT topics"""
+    def _build_route(self) -> Dict[str, Any]:
+        """构建 topic -> handler 路由表，所有订阅共用一个 _on_message 入口"""
+        route = {}
+        
+        # 每种处理函数只绑定一次，路由表中共享同一个bound method
+        agv_h = self._handle_agv_status
+        station_h = self._handle_station_status
+        conveyor_h = self._handle_conveyor_status
+        fault_h = self._handle_fault_alert
+        warehouse_h = self._handle_warehouse_status
+        
         # 订阅所有生产线状态
-        for line_id in ["line1", "line2", "line3"]:
+        for line_id in LINES:
             # AGV状态
-            for agv_id in ["AGV_1", "AGV_2"]:
+            for agv_id in AGVS:
                 topic = self.topic_manager.get_agv_status_topic(line_id, agv_id)
-                self.mqtt_client.subscribe(topic, self._handle_agv_status)
+                route[topic] = agv_h
             
             # 工站状态
-            for station_id in ["StationA", "StationB", "StationC", "QualityCheck"]:
+            for station_id in STATIONS:
                 topic = self.topic_manager.get_station_status_topic(line_id, station_id)
-                self.mqtt_client.subscribe(topic, self._handle_station_status)
+                route[topic] = station_h
             
             # 传送带状态
-            for conveyor_id in ["Conveyor_AB", "Conveyor_BC", "Conveyor_CQ"]:
+            for conveyor_id in CONVEYORS:
                 topic = self.topic_manager.get_conveyor_status_topic(line_id, conveyor_id)
-                self.mqtt_client.subscribe(topic, self._handle_conveyor_status)
+                route[topic] = conveyor_h
             
             # 故障告警
             topic = self.topic_manager.get_fault_alert_topic(line_id)
-            self.mqtt_client.subscribe(topic, self._handle_fault_alert)
+            route[topic] = fault_h
         
         # 订阅全局状态
-        self.mqtt_client.subscribe(self.topic_manager.get_order_topic(), self._handle_order_status)
-        self.mqtt_client.subscribe(self.topic_manager.get_kpi_topic(), self._handle_kpi_status)
+        route[self.topic_manager.get_order_topic()] = self._handle_order_status
+        route[self.topic_manager.get_kpi_topic()] = self._handle_kpi_status
         
         # 订阅仓库状态
-        for warehouse_id in ["RawMaterial", "Warehouse"]:
+        for warehouse_id in WAREHOUSES:
             topic = self.topic_manager.get_warehouse_status_topic(warehouse_id)
-            self.mqtt_client.subscribe(topic, self._handle_warehouse_status)
+            route[topic] = warehouse_h
+        
+        return route
+    
+    def _subscribe_topics(self):
+        """订阅所有相关MQTT topics"""
+        for topic in self._route:
+            self.mqtt_client.subscribe(topic, self._on_message)
         
         logger.info("Subscribed to all factory status topics")
     
-    def _handle_agv_status(self, topic: str, payload: bytes):
+    def _on_message(self, topic: str, payload: bytes):
+        """MQTT回调（运行在paho网络线程），只把消息转交给事件循环"""
+        self._loop.call_soon_threadsafe(self._inbox.put_nowait, (topic, payload))
+    
+    async def _dispatch_loop(self):
+        """从收件箱取出消息，按topic精确匹配分发到对应的处理函数"""
+        inbox = self._inbox
+        route_get = self._route.get
+        while self.running:
+            # 突发到达时一次最多处理 _DISPATCH_BATCH 条再让出事件循环
+            items = [await inbox.get()]
+            while not inbox.empty() and len(items) < _DISPATCH_BATCH:
+                items.append(inbox.get_nowait())
+            if len(items) > 1:
+                items = self._coalesce_snapshots(items)
+            
+            for topic, payload in items:
+                handler = route_get(topic)
+                if handler:
+                    handler(payload)
+            self.batch_ready.set()
+            
+            await asyncio.sleep(0)
+    
+    def _coalesce_snapshots(self, items: List[Tuple[str, bytes]]) -> List[Tuple[str, bytes]]:
+        """
+        丢弃与同一topic下一条快照字节完全相同的设备状态快照，其余消息保持原有顺序
+
+        状态按变化发布，中间快照（如故障后又恢复）都可能触发事件，只有重复快照可以安全丢弃
+        """
+        snapshot_topics = self._snapshot_topics
+        next_payload: Dict[str, bytes] = {}
+        kept = []
+        for topic, payload in reversed(items):
+            if topic in snapshot_topics:
+                if next_payload.get(topic) == payload:
+                    continue
+                next_payload[topic] = payload
+            kept.append((topic, payload))
+        if len(kept) == len(items):
+            return items
+        kept.reverse()
+        return kept
+    
+    def _handle_agv_status(self, payload: bytes):
         """处理AGV状态更新"""
         try:
-            data = json.loads(payload.decode('utf-8'))
+            data = _loads(payload)
             self.state_collector.update_agv_status(data)
             
             # 生成简单的事件描述
@@ -170,12 +286,12 @@ class LLMFactoryAgent:
                 self.state.add_event(f"⚠️ {agv_id} 电量危险低！")
                 
         except Exception as e:
-            logger.error(f"Error handling AGV status: {e}")
+            logger.error("Error handling AGV status: %s", e)
     
-    def _handle_station_status(self, topic: str, payload: bytes):
+    def _handle_station_status(self, payload: bytes):
         """处理工站状态更新"""
         try:
-            data = json.loads(payload.decode('utf-8'))
+            data = _loads(payload)
             self.state_collector.update_station_status(data)
             
             station_id = data.get("source_id", "unknown")
@@ -186,12 +302,12 @@ class LLMFactoryAgent:
             self.state.add_event(event)
             
         except Exception as e:
-            logger.error(f"Error handling station status: {e}")
+            logger.error("Error handling station status: %s", e)
     
-    def _handle_conveyor_status(self, topic: str, payload: bytes):
+    def _handle_conveyor_status(self, payload: bytes):
         """处理传送带状态更新"""
         try:
-            data = json.loads(payload.decode('utf-8'))
+            data = _loads(payload)
             self.state_collector.update_conveyor_status(data)
             
             conveyor_id = data.get("source_id", "unknown")
@@ -203,12 +319,12 @@ class LLMFactoryAgent:
                 self.state.add_event(event)
                 
         except Exception as e:
-            logger.error(f"Error handling conveyor status: {e}")
+            logger.error("Error handling conveyor status: %s", e)
     
-    def _handle_fault_alert(self, topic: str, payload: bytes):
+    def _handle_fault_alert(self, payload: bytes):
         """处理故障告警"""
         try:
-            data = json.loads(payload.decode('utf-8'))
+            data = _loads(payload)
             device_id = data.get("device_id", "unknown")
             alert_type = data.get("alert_type", "unknown")
             
@@ -220,12 +336,12 @@ class LLMFactoryAgent:
             self.state.add_event(event)
             
         except Exception as e:
-            logger.error(f"Error handling fault alert: {e}")
+            logger.error("Error handling fault alert: %s", e)
     
-    def _handle_order_status(self, topic: str, payload: bytes):
+    def _handle_order_status(self, payload: bytes):
         """处理订单状态更新"""
         try:
-            data = json.loads(payload.decode('utf-8'))
+            data = _loads(payload)
             order_id = data.get("order_id", "unknown")
             items = data.get("items", [])
             priority = data.get("priority", "low")
@@ -235,53 +351,44 @@ class LLMFactoryAgent:
             self.state.add_event(event)
             
         except Exception as e:
-            logger.error(f"Error handling order status: {e}")
+            logger.error("Error handling order status: %s", e)
     
-    def _handle_kpi_status(self, topic: str, payload: bytes):
+    def _handle_kpi_status(self, payload: bytes):
         """处理KPI状态更新"""
         try:
-            data = json.loads(payload.decode('utf-8'))
+            data = _loads(payload)
             order_rate = data.get("order_completion_rate", 0)
             
             # 只在KPI显著变化时记录
-            if abs(order_rate - self.state.factory_state.get("last_order_rate", 0)) > 5:
+            if abs(order_rate - self.state.last_order_rate) > 5:
                 event = f"📊 订单完成率: {order_rate:.1f}%"
                 self.state.add_event(event)
-                self.state.factory_state["last_order_rate"] = order_rate
+                self.state.last_order_rate = order_rate
                 
         except Exception as e:
-            logger.error(f"Error handling KPI status: {e}")
+            logger.error("Error handling KPI status: %s", e)
     
-    def _handle_warehouse_status(self, topic: str, payload: bytes):
+    def _handle_warehouse_status(self, payload: bytes):
         """处理仓库状态更新"""
         try:
-            data = json.loads(payload.decode('utf-8'))
+            data = _loads(payload)
             warehouse_id = data.get("source_id", "unknown")
             buffer_count = len(data.get("buffer", []))
             
-            # 记录仓库状态到factory_state，但不生成事件（太频繁）
-            self.state.factory_state[f"{warehouse_id}_buffer_count"] = buffer_count
+            # 记录仓库库存数量，但不生成事件（太频繁）
+            self.state.warehouse_buffer_counts[warehouse_id] = buffer_count
             
         except Exception as e:
-            logger.error(f"Error handling warehouse status: {e}")
-    
-    async def _state_update_loop(self):
-        """状态更新循环"""
-        while self.running:
-            self.state.current_time = time.time()
-            await asyncio.sleep(1.0)  # 每秒更新一次时间
+            logger.error("Error handling warehouse status: %s", e)
     
     async def _decision_loop(self):
         """决策循环"""
         while self.running:
-            current_time = time.time()
-            
-            # 检查是否到达决策间隔
-            if current_time - self.state.last_decision_time >= self.state.decision_interval:
-                await self._make_decision()
-                self.state.last_decision_time = current_time
-            
-            await asyncio.sleep(1.0)  # 每秒检查一次
+            # 每个决策间隔只唤醒一次
+            await asyncio.sleep(self.state.decision_interval)
+            await self._make_decision()
+            self.state.last_decision_time = time.time()
+            self.decision_made.set()
     
     async def _make_decision(self):
         """制定决策（当前是简单规则，后续会替换为LLM）"""
@@ -292,13 +399,13 @@ class LLMFactoryAgent:
             commands = self._generate_simple_commands()
             
             if commands:
-                for command in commands:
-                    await self._send_command(command)
+                # 各命令互不依赖，一次性并发发送
+                await asyncio.gather(*map(self._send_command, commands))
                     
-                logger.info(f"Sent {len(commands)} commands")
+                logger.info("Sent %d commands", len(commands))
             
         except Exception as e:
-            logger.error(f"Error in decision making: {e}")
+            logger.error("Error in decision making: %s", e)
     
     def _generate_simple_commands(self) -> List[Dict]:
         """生成简单命令（临时实现，后续会用LLM替换）"""
@@ -306,21 +413,19 @@ class LLMFactoryAgent:
         
         # 简单策略：找到空闲的AGV让它去取原料
         agv_states = self.state_collector.get_agv_states()
+        command_id = f"simple_{int(time.time())}"
         
-        for line_id in ["line1", "line2", "line3"]:
-            for agv_id in ["AGV_1", "AGV_2"]:
-                agv_key = f"{line_id}_{agv_id}"
+        for line_id, agv_slots in self._agv_slots:
+            for agv_id, agv_key in agv_slots:
                 agv_data = agv_states.get(agv_key)
                 
                 if agv_data and self._should_send_agv_to_pickup(agv_data):
-                    # 发送AGV去原料仓库
-                    command = {
-                        "command_id": f"simple_{int(time.time())}",
-                        "action": "move",
-                        "target": agv_id,
-                        "params": {"target_point": "P0"}
-                    }
-                    commands.append((line_id, command))
+                    # 发送AGV去原料仓库（模板只读，params共享即可）
+                    command = self._pickup_command_template.copy()
+                    command["command_id"] = command_id
+                    command["target"] = agv_id
+                    # 内部构造的命令字段齐全，标记为可信以跳过校验
+                    commands.append((line_id, command, True))
                     break  # 每条线只派一个AGV
         
         return commands[:2]  # 限制同时命令数量
@@ -343,21 +448,29 @@ class LLMFactoryAgent:
     async def _send_command(self, command_data):
         """发送命令到指定生产线"""
         try:
-            line_id, command = command_data
-            
-            # 验证命令格式
-            validated_command = AgentCommand.model_validate(command)
+            # command_data: (line_id, command) 或 (line_id, command, trusted)
+            line_id, command = command_data[0], command_data[1]
+            trusted = len(command_data) > 2 and command_data[2]
             
             # 发送到对应生产线的命令topic
-            topic = self.topic_manager.get_agent_command_topic(line_id)
-            payload = validated_command.model_dump_json()
+            topic = self._cmd_topics.get(line_id) or self.topic_manager.get_agent_command_topic(line_id)
+            
+            if trusted:
+                # 内部生成的命令直接序列化
+                payload = orjson.dumps(command).decode()
+            else:
+                # 外部来源的命令需要验证格式
+                validated_command = _CMD_VALIDATOR.validate_python(command)
+                payload = _CMD_SERIALIZER.to_json(validated_command).decode()
             
-            self.mqtt_client.publish(topic, payload)
+            # 决策循环会周期性重发命令，使用QoS 0避免PUBACK往返；
+            # 若后续命令需要可靠送达，需先保证命令幂等再改用QoS 1
+            self.mqtt_client.publish(topic, payload, qos=0, retain=False)
             
-            logger.info(f"Sent command to {line_id}: {command['action']} {command['target']}")
+            logger.info("Sent command to %s: %s %s", line_id, command['action'], command['target'])
             
         except Exception as e:
-            logger.error(f"Error sending command: {e}")
+            logger.error("Error sending command: %s", e)
     
     def get_status_summary(self) -> Dict:
         """获取智能体状态摘要"""
@@ -366,7 +479,7 @@ class LLMFactoryAgent:
             "mqtt_connected": self.mqtt_client.is_connected(),
             "recent_events_count": len(self.state.recent_events),
             "last_decision_time": self.state.last_decision_time,
-            "factory_state_keys": list(self.state.factory_state.keys())
+            "warehouse_buffer_counts": dict(self.state.warehouse_buffer_counts)
         }
 
 
@@ -394,7 +507,7 @@ async def main():
     except KeyboardInterrupt:
         print("Agent stopped by user")
     except Exception as e:
-        logger.error(f"Agent error: {e}")
+        logger.error("Agent error: %s", e)
     finally:
         await agent.stop()
 
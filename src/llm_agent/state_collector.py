@@ -8,16 +8,70 @@
 - 上下文管理和压缩
 """
 
+import heapq
+import logging
+import sys
 import time
-import hashlib
-from typing import Dict, List, Optional, Any, Tuple
+from collections import deque
+import itertools
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Union
 from dataclasses import dataclass, field
-from enum import Enum
+from enum import IntEnum
+from functools import lru_cache
+
+import orjson
 
 from src.utils.topic_manager import TopicManager
 
+logger = logging.getLogger(__name__)
+
+# 工厂生产线ID
+LINES = ("line1", "line2", "line3")
+
+# 自然语言描述用到的状态/趋势短语，模块加载时构建一次
+AGV_STATUS_DESC = {
+    "idle": "空闲",
+    "moving": "移动中",
+    "loading": "装载中",
+    "unloading": "卸载中",
+    "charging": "充电中",
+    "error": "故障",
+    "fault": "异常",
+    "stuck": "卡住"
+}
+
+BATTERY_TREND_DESC = {
+    "improving": "持续回升",
+    "degrading": "持续下降",
+    "stable": "相对稳定"
+}
+
+# AGV故障状态，以及从故障中恢复后的正常状态
+FAULT_STATUSES = frozenset(("error", "fault", "stuck"))
+RECOVERED_STATUSES = frozenset(("idle", "moving"))
+
+# 事件类型前缀（第一个"_"之前） -> (类别, 上下文标签, 数据中的设备ID字段)
+_EVENT_KINDS = {
+    "agv": ("agv", "AGV", "agv_id"),
+    "station": ("station", "Station", "station_id"),
+    "conveyor": ("conveyor", "Conveyor", "conveyor_id"),
+}
+
 
-class EventImportance(Enum):
+@lru_cache(maxsize=2048)
+def _status_transition_nl(device_id: str, old_status: str, new_status: str) -> str:
+    """AGV状态转换描述：设备和状态组合有限，同一转换重复出现时直接复用"""
+    old_desc = AGV_STATUS_DESC.get(old_status, old_status)
+    new_desc = AGV_STATUS_DESC.get(new_status, new_status)
+    return f"AGV {device_id} 从 {old_desc} 转为 {new_desc}"
+
+
+def _intern(value: Any) -> Any:
+    """驻留状态字符串：取值集合很小，驻留后相同状态共享同一对象，比较时直接命中身份判断"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class EventImportance(IntEnum):
     """事件重要性级别"""
     CRITICAL = 4    # 紧急情况，需要立即处理
     HIGH = 3        # 高优先级，需要关注
@@ -26,18 +80,41 @@ class EventImportance(Enum):
     NOISE = 0       # 噪音事件，可忽略
 
 
-@dataclass
+# 各重要性级别的频率限制窗口相对rate_limit_window的倍数
+_RATE_LIMIT_FACTORS = {
+    EventImportance.HIGH: 1,
+    EventImportance.MEDIUM: 2,
+    EventImportance.LOW: 4,
+}
+
+# 自然语言摘要中各重要性分组的标题
+SUMMARY_HEADERS = {
+    EventImportance.CRITICAL: "🚨 紧急情况",
+    EventImportance.HIGH: "⚠️ 重要事件",
+    EventImportance.MEDIUM: "ℹ️ 常规事件",
+}
+SUMMARY_BULLET = "  - "
+
+# 电量提示：(电量上限, 提示语)，按电量从低到高匹配第一个
+BATTERY_WARNINGS = (
+    (5, " ⚠️ 紧急电量警告！立即充电"),
+    (10, " ⚠️ 紧急充电建议"),
+    (20, " ⚡ 建议尽快充电"),
+)
+
+
+@dataclass(slots=True, frozen=True)
 class EventMetadata:
     """事件元数据"""
     importance: EventImportance
     category: str  # 'agv', 'station', 'conveyor', 'system'
     dedupe_key: str  # 用于去重的键
     nl_description: str  # 自然语言描述
-    context_tags: List[str] = field(default_factory=list)  # 上下文标签
+    context_tags: Tuple[str, ...] = ()  # 上下文标签
     trend_indicator: Optional[str] = None  # 趋势指示器 'improving', 'degrading', 'stable'
 
 
-@dataclass
+@dataclass(slots=True)
 class DeviceState:
     """设备状态基类"""
     device_id: str
@@ -46,7 +123,7 @@ class DeviceState:
     last_updated: float = field(default_factory=time.time)
 
 
-@dataclass  
+@dataclass(slots=True)
 class AGVState(DeviceState):
     """AGV状态"""
     current_point: str = "unknown"
@@ -56,28 +133,40 @@ class AGVState(DeviceState):
     line_id: str = "unknown"
 
 
-@dataclass
+@dataclass(slots=True)
 class StationState(DeviceState):
     """工站状态"""
     buffer: List[str] = field(default_factory=list)
+    buffer_count: int = field(init=False, default=0)  # len(buffer)，构造时由__post_init__写入
     stats: Dict[str, Any] = field(default_factory=dict)
     line_id: str = "unknown"
+    
+    def __post_init__(self):
+        self.buffer_count = len(self.buffer)
 
 
-@dataclass
+@dataclass(slots=True)
 class ConveyorState(DeviceState):
     """传送带状态"""
     buffer: List[str] = field(default_factory=list)
+    buffer_count: int = field(init=False, default=0)  # len(buffer)，构造时由__post_init__写入
     upper_buffer: Optional[List[str]] = None
     lower_buffer: Optional[List[str]] = None
     line_id: str = "unknown"
+    
+    def __post_init__(self):
+        self.buffer_count = len(self.buffer)
 
 
-@dataclass
+@dataclass(slots=True)
 class WarehouseState(DeviceState):
     """仓库状态"""
     buffer: List[str] = field(default_factory=list)
+    buffer_count: int = field(init=False, default=0)  # len(buffer)，构造时由__post_init__写入
     stats: Dict[str, Any] = field(default_factory=dict)
+    
+    def __post_init__(self):
+        self.buffer_count = len(self.buffer)
 
 
 class StateCollector:
@@ -99,11 +188,32 @@ class StateCollector:
         self.station_states: Dict[str, StationState] = {}
         self.conveyor_states: Dict[str, ConveyorState] = {}
         self.warehouse_states: Dict[str, WarehouseState] = {}
+        # 序列化后的状态视图，仅在状态更新时重建，查询时直接复用（调用方只读）
+        self._agv_views: Dict[str, Dict[str, Any]] = {}
+        self._station_views: Dict[str, Dict[str, Any]] = {}
+        self._conveyor_views: Dict[str, Dict[str, Any]] = {}
+        self._warehouse_views: Dict[str, Dict[str, Any]] = {}
+        # 按生产线索引的设备键（dict当作有序集合使用）和产品数累计
+        self._by_line: Dict[str, Dict[str, Dict[str, None]]] = {}
+        self._line_products: Dict[str, int] = {}
+        # 各生产线当前的紧急问题：device_key -> 描述，在状态更新时维护
+        self._urgent_by_line: Dict[str, Dict[str, str]] = {}
+        self._line_cache: Dict[str, str] = {}  # device_id -> line_id
+        # 生产线摘要和工厂概览缓存，相关状态更新时失效
+        self._line_summary_cache: Dict[str, Dict[str, Any]] = {}
+        self._overview_cache: Optional[Dict[str, Any]] = None
         
         # 增强的事件管理
-        self.filtered_events: List[Dict[str, Any]] = []
-        self.event_dedup_cache: Dict[str, float] = {}  # 去重缓存：key -> last_timestamp
         self.max_events = 200  # 增加事件容量
+        self.filtered_events: Deque[Dict[str, Any]] = deque(maxlen=self.max_events)
+        # 按重要性分桶的事件队列，高重要性事件不会被大量低重要性事件挤掉
+        self.events_by_importance: Dict[EventImportance, Deque[Dict[str, Any]]] = {
+            level: deque(maxlen=self.max_events)
+            for level in EventImportance if level != EventImportance.NOISE
+        }
+        self._event_seq = itertools.count()  # 事件插入序号，用于跨分桶合并时保持顺序
+        self.event_dedup_cache: Dict[str, float] = {}  # 去重缓存：key -> last_timestamp
+        self._dedup_expiry: List[Tuple[float, str]] = []  # 去重缓存过期小顶堆：(expiry_time, key)
         self.max_context_window = 50  # LLM上下文窗口大小
         
         # 事件过滤配置
@@ -112,20 +222,22 @@ class StateCollector:
         self.rate_limit_window = 5  # 相似事件频率限制（秒）
         
         # 状态历史（用于趋势分析）
-        self.state_history: Dict[str, List[Dict]] = {}
         self.max_history_per_device = 10
+        self.battery_history: Dict[str, Deque[float]] = {}  # device_key -> 最近的电量读数
     
     def update_agv_status(self, data: Dict[str, Any]):
         """更新AGV状态"""
         try:
+            now = time.time()
             agv_id = data.get("source_id", "unknown")
-            line_id = self._extract_line_id_from_agv(agv_id)
+            line_id = self._line_id(agv_id)
             
             # 创建状态对象
             agv_state = AGVState(
                 device_id=agv_id,
-                timestamp=data.get("timestamp", time.time()),
-                status=data.get("status", "unknown"),
+                timestamp=data.get("timestamp", now),
+                last_updated=now,
+                status=_intern(data.get("status", "unknown")),
                 current_point=data.get("current_point", "unknown"),
                 target_point=data.get("target_point"),
                 battery_level=data.get("battery_level", 0.0),
@@ -137,32 +249,34 @@ class StateCollector:
             key = f"{line_id}_{agv_id}"
             old_state = self.agv_states.get(key)
             
-            self._process_agv_state_change(old_state, agv_state, key)
+            self._process_agv_state_change(old_state, agv_state, key, current_time=now)
             
             # 存储状态
+            if old_state is None:
+                self._index_device(line_id, "agv", key)
             self.agv_states[key] = agv_state
+            self._agv_views[key] = self._agv_state_view(agv_state)
+            self._set_urgent(line_id, key, f"{agv_id} 电量危险低" if agv_state.battery_level < 15 else None)
+            self._mark_dirty(line_id)
             
             # 更新历史
-            self._update_device_history(key, {
-                "timestamp": agv_state.timestamp,
-                "battery_level": agv_state.battery_level,
-                "status": agv_state.status,
-                "current_point": agv_state.current_point
-            })
+            self._update_device_history(key, agv_state.battery_level)
             
-        except Exception as e:
-            print(f"Error updating AGV status: {e}")
+        except Exception:
+            logger.exception("Error updating AGV status")
     
     def update_station_status(self, data: Dict[str, Any]):
         """更新工站状态"""
         try:
+            now = time.time()
             station_id = data.get("source_id", "unknown")
-            line_id = self._extract_line_id_from_station(station_id)
+            line_id = self._line_id(station_id)
             
             station_state = StationState(
                 device_id=station_id,
-                timestamp=data.get("timestamp", time.time()),
-                status=data.get("status", "unknown"),
+                timestamp=data.get("timestamp", now),
+                last_updated=now,
+                status=_intern(data.get("status", "unknown")),
                 buffer=data.get("buffer", []),
                 stats=data.get("stats", {}),
                 line_id=line_id
@@ -172,38 +286,46 @@ class StateCollector:
             key = f"{line_id}_{station_id}"
             old_state = self.station_states.get(key)
             
-            if old_state and len(station_state.buffer) != len(old_state.buffer):
-                buffer_change = len(station_state.buffer) - len(old_state.buffer)
+            if old_state and station_state.buffer_count != old_state.buffer_count:
+                buffer_change = station_state.buffer_count - old_state.buffer_count
                 self._add_filtered_event(
                     event_type="station_buffer_change",
                     device_id=station_id,
-                    data={
+                    importance=EventImportance.MEDIUM if abs(buffer_change) > 0 else EventImportance.LOW,
+                    build_data=lambda: {
                         "station_id": station_id,
                         "line_id": line_id,
-                        "old_count": len(old_state.buffer),
-                        "new_count": len(station_state.buffer),
+                        "old_count": old_state.buffer_count,
+                        "new_count": station_state.buffer_count,
                         "change": buffer_change,
                         "status": station_state.status
                     },
-                    importance=EventImportance.MEDIUM if abs(buffer_change) > 0 else EventImportance.LOW,
-                    nl_description=f"工站 {station_id} 缓冲区从 {len(old_state.buffer)} 个产品变为 {len(station_state.buffer)} 个产品"
+                    build_nl=lambda: f"工站 {station_id} 缓冲区从 {old_state.buffer_count} 个产品变为 {station_state.buffer_count} 个产品",
+                    current_time=now
                 )
             
+            if old_state is None:
+                self._index_device(line_id, "station", key)
+            self._adjust_line_products(line_id, old_state, station_state)
             self.station_states[key] = station_state
+            self._station_views[key] = self._station_state_view(station_state)
+            self._mark_dirty(line_id)
             
-        except Exception as e:
-            print(f"Error updating station status: {e}")
+        except Exception:
+            logger.exception("Error updating station status")
     
     def update_conveyor_status(self, data: Dict[str, Any]):
         """更新传送带状态"""
         try:
+            now = time.time()
             conveyor_id = data.get("source_id", "unknown")
-            line_id = self._extract_line_id_from_conveyor(conveyor_id)
+            line_id = self._line_id(conveyor_id)
             
             conveyor_state = ConveyorState(
                 device_id=conveyor_id,
-                timestamp=data.get("timestamp", time.time()),
-                status=data.get("status", "unknown"),
+                timestamp=data.get("timestamp", now),
+                last_updated=now,
+                status=_intern(data.get("status", "unknown")),
                 buffer=data.get("buffer", []),
                 upper_buffer=data.get("upper_buffer"),
                 lower_buffer=data.get("lower_buffer"),
@@ -218,148 +340,211 @@ class StateCollector:
                 self._add_filtered_event(
                     event_type="conveyor_blocked",
                     device_id=conveyor_id,
-                    data={
+                    importance=EventImportance.HIGH,
+                    build_data=lambda: {
                         "conveyor_id": conveyor_id,
                         "line_id": line_id,
-                        "buffer_count": len(conveyor_state.buffer)
+                        "buffer_count": conveyor_state.buffer_count
                     },
-                    importance=EventImportance.HIGH,
-                    nl_description=f"传送带 {conveyor_id} 被阻塞，当前缓冲区有 {len(conveyor_state.buffer)} 个产品"
+                    build_nl=lambda: f"传送带 {conveyor_id} 被阻塞，当前缓冲区有 {conveyor_state.buffer_count} 个产品",
+                    current_time=now
                 )
             elif conveyor_state.status != "blocked" and old_state and old_state.status == "blocked":
                 self._add_filtered_event(
                     event_type="conveyor_unblocked",
                     device_id=conveyor_id,
-                    data={
+                    importance=EventImportance.MEDIUM,
+                    build_data=lambda: {
                         "conveyor_id": conveyor_id,
                         "line_id": line_id,
-                        "buffer_count": len(conveyor_state.buffer)
+                        "buffer_count": conveyor_state.buffer_count
                     },
-                    importance=EventImportance.MEDIUM,
-                    nl_description=f"传送带 {conveyor_id} 阻塞解除，当前缓冲区有 {len(conveyor_state.buffer)} 个产品"
+                    build_nl=lambda: f"传送带 {conveyor_id} 阻塞解除，当前缓冲区有 {conveyor_state.buffer_count} 个产品",
+                    current_time=now
                 )
             
+            if old_state is None:
+                self._index_device(line_id, "conveyor", key)
+            self._adjust_line_products(line_id, old_state, conveyor_state)
             self.conveyor_states[key] = conveyor_state
+            self._conveyor_views[key] = self._conveyor_state_view(conveyor_state)
+            self._set_urgent(line_id, key, f"{conveyor_id} 被阻塞" if conveyor_state.status == "blocked" else None)
+            self._mark_dirty(line_id)
             
-        except Exception as e:
-            print(f"Error updating conveyor status: {e}")
+        except Exception:
+            logger.exception("Error updating conveyor status")
     
     def update_warehouse_status(self, data: Dict[str, Any]):
         """更新仓库状态"""
         try:
+            now = time.time()
             warehouse_id = data.get("source_id", "unknown")
             
             warehouse_state = WarehouseState(
                 device_id=warehouse_id,
-                timestamp=data.get("timestamp", time.time()),
+                timestamp=data.get("timestamp", now),
+                last_updated=now,
                 status="active",  # 仓库通常总是活跃的
                 buffer=data.get("buffer", []),
                 stats=data.get("stats", {})
             )
             
             self.warehouse_states[warehouse_id] = warehouse_state
+            self._warehouse_views[warehouse_id] = self._warehouse_state_view(warehouse_state)
+            self._overview_cache = None
             
-        except Exception as e:
-            print(f"Error updating warehouse status: {e}")
-    
-    def _extract_line_id_from_agv(self, agv_id: str) -> str:
-        """从AGV ID推断生产线ID"""
-        # 假设AGV命名格式：AGV_1, AGV_2等，需要从topic或其他方式获取line_id
-        # 这里简化处理，后续可以从topic解析
-        return "unknown"
-    
-    def _extract_line_id_from_station(self, station_id: str) -> str:
-        """从工站ID推断生产线ID"""
-        return "unknown"
-    
-    def _extract_line_id_from_conveyor(self, conveyor_id: str) -> str:
-        """从传送带ID推断生产线ID"""
-        return "unknown"
-    
-    def _process_agv_state_change(self, old_state: Optional[AGVState], new_state: AGVState, device_key: str):
+        except Exception:
+            logger.exception("Error updating warehouse status")
+    
+    def _index_device(self, line_id: str, category: str, key: str):
+        """将新设备登记到所属生产线的索引中"""
+        line = self._by_line.get(line_id)
+        if line is None:
+            line = self._by_line[line_id] = {"agv": {}, "station": {}, "conveyor": {}}
+        line[category][key] = None
+    
+    def _adjust_line_products(self, line_id: str, old_state: Optional[Union[StationState, ConveyorState]],
+                              new_state: Union[StationState, ConveyorState]):
+        """按缓冲区数量变化增量更新生产线产品总数"""
+        delta = new_state.buffer_count - (old_state.buffer_count if old_state else 0)
+        if delta:
+            self._line_products[line_id] = self._line_products.get(line_id, 0) + delta
+    
+    def _set_urgent(self, line_id: str, key: str, issue: Optional[str]):
+        """登记或清除设备的紧急问题，issue为None表示已恢复"""
+        urgent = self._urgent_by_line.get(line_id)
+        if issue is None:
+            if urgent:
+                urgent.pop(key, None)
+            return
+        if urgent is None:
+            urgent = self._urgent_by_line[line_id] = {}
+        urgent[key] = issue
+    
+    def _mark_dirty(self, line_id: str):
+        """使该生产线摘要和工厂概览的缓存失效"""
+        self._line_summary_cache.pop(line_id, None)
+        self._overview_cache = None
+    
+    def _line_id(self, device_id: str) -> str:
+        """从设备ID推断生产线ID，结果按设备缓存"""
+        line_id = self._line_cache.get(device_id)
+        if line_id is None:
+            # 设备ID目前不含生产线信息，需要从topic或其他方式获取line_id
+            # 这里简化处理，后续可以从topic解析
+            line_id = self._line_cache[device_id] = "unknown"
+        return line_id
+    
+    def _process_agv_state_change(self, old_state: Optional[AGVState], new_state: AGVState, device_key: str,
+                                  current_time: Optional[float] = None):
         """处理AGV状态变化，生成智能过滤的事件"""
-        current_time = time.time()
+        if current_time is None:
+            current_time = time.time()
+        agv_id = new_state.device_id
         
         # 1. 状态变化事件
         if not old_state or old_state.status != new_state.status:
             self._add_filtered_event(
                 event_type="agv_status_change",
-                device_id=new_state.device_id,
-                data={
-                    "agv_id": new_state.device_id,
+                device_id=agv_id,
+                importance=self._evaluate_status_change_importance(old_state, new_state),
+                build_data=lambda: {
+                    "agv_id": agv_id,
                     "line_id": new_state.line_id,
                     "old_status": old_state.status if old_state else None,
                     "new_status": new_state.status,
                     "position": new_state.current_point
                 },
-                importance=self._evaluate_status_change_importance(old_state, new_state),
-                nl_description=self._generate_agv_status_nl(old_state, new_state)
+                build_nl=lambda: self._generate_agv_status_nl(old_state, new_state),
+                current_time=current_time
             )
         
-        # 2. 位置变化事件
+        # 2. 位置变化事件（按起点和终点去重）
         if not old_state or old_state.current_point != new_state.current_point:
+            from_point = old_state.current_point if old_state else "unknown"
             self._add_filtered_event(
                 event_type="agv_position_change",
-                device_id=new_state.device_id,
-                data={
-                    "agv_id": new_state.device_id,
+                device_id=agv_id,
+                importance=EventImportance.LOW,
+                build_data=lambda: {
+                    "agv_id": agv_id,
                     "line_id": new_state.line_id,
-                    "from_point": old_state.current_point if old_state else "unknown",
+                    "from_point": from_point,
                     "to_point": new_state.current_point,
                     "target_point": new_state.target_point
                 },
-                importance=EventImportance.LOW,
-                nl_description=f"AGV {new_state.device_id} 从 {old_state.current_point if old_state else '未知位置'} 移动到 {new_state.current_point}"
+                build_nl=lambda: f"AGV {agv_id} 从 {old_state.current_point if old_state else '未知位置'} 移动到 {new_state.current_point}",
+                dedupe_key=f"agv_position_change:{agv_id}:{from_point}->{new_state.current_point}",
+                current_time=current_time
             )
         
-        # 3. 电量变化事件（智能过滤）
+        # 3. 电量变化事件（智能过滤，按设备和10%电量档位去重）
         if old_state and abs(old_state.battery_level - new_state.battery_level) >= self.battery_threshold:
             battery_trend = self._analyze_battery_trend(device_key, new_state.battery_level)
+            battery_range = int(new_state.battery_level // 10) * 10
             self._add_filtered_event(
                 event_type="agv_battery_change",
-                device_id=new_state.device_id,
-                data={
-                    "agv_id": new_state.device_id,
+                device_id=agv_id,
+                importance=self._evaluate_battery_importance(new_state.battery_level, battery_trend),
+                build_data=lambda: {
+                    "agv_id": agv_id,
                     "line_id": new_state.line_id,
                     "old_level": old_state.battery_level,
                     "new_level": new_state.battery_level,
                     "change": new_state.battery_level - old_state.battery_level,
                     "trend": battery_trend
                 },
-                importance=self._evaluate_battery_importance(new_state.battery_level, battery_trend),
-                nl_description=self._generate_battery_change_nl(new_state, old_state, battery_trend)
+                build_nl=lambda: self._generate_battery_change_nl(new_state, old_state, battery_trend),
+                dedupe_key=f"agv_battery_change:{agv_id}:{battery_range}",
+                trend=battery_trend,
+                current_time=current_time
             )
         
         # 4. 载货变化事件
         if not old_state or len(old_state.payload) != len(new_state.payload):
-            payload_change = len(new_state.payload) - (len(old_state.payload) if old_state else 0)
+            old_count = len(old_state.payload) if old_state else 0
+            payload_change = len(new_state.payload) - old_count
             self._add_filtered_event(
                 event_type="agv_payload_change",
-                device_id=new_state.device_id,
-                data={
-                    "agv_id": new_state.device_id,
+                device_id=agv_id,
+                importance=EventImportance.MEDIUM if payload_change != 0 else EventImportance.LOW,
+                build_data=lambda: {
+                    "agv_id": agv_id,
                     "line_id": new_state.line_id,
-                    "old_count": len(old_state.payload) if old_state else 0,
+                    "old_count": old_count,
                     "new_count": len(new_state.payload),
                     "change": payload_change,
                     "payload_items": new_state.payload
                 },
-                importance=EventImportance.MEDIUM if payload_change != 0 else EventImportance.LOW,
-                nl_description=self._generate_payload_change_nl(new_state, payload_change)
+                build_nl=lambda: self._generate_payload_change_nl(new_state, payload_change),
+                current_time=current_time
             )
 
-    def _add_filtered_event(self, event_type: str, device_id: str, data: Dict[str, Any], 
-                           importance: EventImportance, nl_description: str):
-        """添加经过智能过滤的事件"""
-        current_time = time.time()
-        
-        # 生成去重键
-        dedupe_key = self._generate_dedupe_key(event_type, device_id, data)
+    def _add_filtered_event(self, event_type: str, device_id: str, importance: EventImportance,
+                           build_data: Callable[[], Dict[str, Any]], build_nl: Callable[[], str],
+                           dedupe_key: Optional[str] = None, current_time: Optional[float] = None,
+                           trend: Optional[str] = None):
+        """
+        添加经过智能过滤的事件
+        
+        先做去重和频率限制检查，只有事件真正被记录时才调用 build_data / build_nl
+        构造事件数据、自然语言描述和元数据；被过滤的事件仍会在调用方创建这两个
+        闭包，省下的是闭包内的字典和字符串构造。dedupe_key 默认按事件类型和设备去重，
+        current_time 由调用方传入以复用同一次取时；trend 为电量等趋势类事件的趋势。
+        """
+        if current_time is None:
+            current_time = time.time()
+        
+        if dedupe_key is None:
+            dedupe_key = f"{event_type}:{device_id}"
         
         # 检查去重和频率限制
         if self._should_filter_event(dedupe_key, importance, current_time):
             return
         
+        data = build_data()
+        nl_description = build_nl()
+        
         # 创建事件元数据
         metadata = EventMetadata(
             importance=importance,
@@ -367,7 +552,7 @@ class StateCollector:
             dedupe_key=dedupe_key,
             nl_description=nl_description,
             context_tags=self._generate_context_tags(event_type, data),
-            trend_indicator=data.get("trend")
+            trend_indicator=trend
         )
         
         # 添加事件
@@ -377,15 +562,19 @@ class StateCollector:
             "device_id": device_id,
             "data": data,
             "metadata": metadata,
-            "importance": importance.value,
-            "nl_description": nl_description
+            "importance": importance,
+            "nl_description": nl_description,
+            "trend": trend,
+            "seq": next(self._event_seq)
         }
         
         self.filtered_events.append(event)
+        self.events_by_importance[importance].append(event)
         self.event_dedup_cache[dedupe_key] = current_time
+        heapq.heappush(self._dedup_expiry, (current_time + self.dedup_window * 2, dedupe_key))
         
         # 维护事件数量限制
-        self._maintain_event_limits()
+        self._maintain_event_limits(current_time)
     
     def _should_filter_event(self, dedupe_key: str, importance: EventImportance, current_time: float) -> bool:
         """判断是否应该过滤掉这个事件"""
@@ -400,50 +589,26 @@ class StateCollector:
         # 检查去重缓存
         last_time = self.event_dedup_cache.get(dedupe_key)
         if last_time:
-            time_diff = current_time - last_time
-            
             # 根据重要性调整过滤时间窗口
-            filter_window = {
-                EventImportance.HIGH: self.rate_limit_window,
-                EventImportance.MEDIUM: self.rate_limit_window * 2,
-                EventImportance.LOW: self.rate_limit_window * 4
-            }.get(importance, self.dedup_window)
+            factor = _RATE_LIMIT_FACTORS.get(importance)
+            filter_window = self.rate_limit_window * factor if factor else self.dedup_window
             
-            if time_diff < filter_window:
+            if current_time - last_time < filter_window:
                 return True
         
         return False
     
-    def _generate_dedupe_key(self, event_type: str, device_id: str, data: Dict[str, Any]) -> str:
-        """生成事件去重键"""
-        # 根据事件类型生成不同的去重策略
-        if event_type == "agv_battery_change":
-            # 电量事件按设备和大致电量级别去重
-            battery_level = data.get("new_level", 0)
-            battery_range = int(battery_level // 10) * 10  # 按10%分档
-            key_data = f"{event_type}:{device_id}:{battery_range}"
-        elif event_type == "agv_position_change":
-            # 位置变化按起点和终点去重
-            from_point = data.get("from_point", "")
-            to_point = data.get("to_point", "")
-            key_data = f"{event_type}:{device_id}:{from_point}->{to_point}"
-        else:
-            # 默认按事件类型和设备去重
-            key_data = f"{event_type}:{device_id}"
-        
-        return hashlib.md5(key_data.encode()).hexdigest()[:16]
-    
     def _evaluate_status_change_importance(self, old_state: Optional[AGVState], new_state: AGVState) -> EventImportance:
         """评估状态变化的重要性"""
         if not old_state:
             return EventImportance.MEDIUM
         
         # 故障状态变化为紧急
-        if new_state.status in ["error", "fault", "stuck"]:
+        if new_state.status in FAULT_STATUSES:
             return EventImportance.CRITICAL
         
         # 从故障恢复为高优先级
-        if old_state.status in ["error", "fault", "stuck"] and new_state.status in ["idle", "moving"]:
+        if old_state.status in FAULT_STATUSES and new_state.status in RECOVERED_STATUSES:
             return EventImportance.HIGH
         
         # 其他状态变化为中等优先级
@@ -467,59 +632,38 @@ class StateCollector:
         if not old_state:
             return f"AGV {new_state.device_id} 初始状态为 {new_state.status}，位于 {new_state.current_point}"
         
-        status_desc = {
-            "idle": "空闲",
-            "moving": "移动中",
-            "loading": "装载中",
-            "unloading": "卸载中",
-            "charging": "充电中",
-            "error": "故障",
-            "fault": "异常",
-            "stuck": "卡住"
-        }
-        
-        old_desc = status_desc.get(old_state.status, old_state.status)
-        new_desc = status_desc.get(new_state.status, new_state.status)
-        
-        base_msg = f"AGV {new_state.device_id} 从 {old_desc} 转为 {new_desc}"
+        parts = [_status_transition_nl(new_state.device_id, old_state.status, new_state.status)]
         
         # 添加位置信息
         if new_state.current_point != old_state.current_point:
-            base_msg += f"，位置从 {old_state.current_point} 变为 {new_state.current_point}"
+            parts.append(f"，位置从 {old_state.current_point} 变为 {new_state.current_point}")
         
         # 添加电量信息
         if new_state.battery_level <= 15:
-            base_msg += f"，当前电量 {new_state.battery_level:.1f}% (低电量警告)"
+            parts.append(f"，当前电量 {new_state.battery_level:.1f}% (低电量警告)")
         
-        return base_msg
+        return "".join(parts)
     
     def _generate_battery_change_nl(self, new_state: AGVState, old_state: AGVState, trend: str) -> str:
         """生成电量变化的自然语言描述"""
         change = new_state.battery_level - old_state.battery_level
         
-        trend_desc = {
-            "improving": "持续回升",
-            "degrading": "持续下降",
-            "stable": "相对稳定"
-        }
-        
-        base_msg = f"AGV {new_state.device_id} 电量从 {old_state.battery_level:.1f}% 变为 {new_state.battery_level:.1f}%"
+        parts = [f"AGV {new_state.device_id} 电量从 {old_state.battery_level:.1f}% 变为 {new_state.battery_level:.1f}%"]
         
         if abs(change) >= 20:
             change_desc = "大幅上升" if change > 0 else "大幅下降"
-            base_msg += f" ({change_desc} {abs(change):.1f}%)"
+            parts.append(f" ({change_desc} {abs(change):.1f}%)")
         
-        if trend in trend_desc:
-            base_msg += f"，趋势：{trend_desc[trend]}"
+        trend_desc = BATTERY_TREND_DESC.get(trend)
+        if trend_desc:
+            parts.append(f"，趋势：{trend_desc}")
         
-        if new_state.battery_level <= 5:
-            base_msg += " ⚠️ 紧急电量警告！立即充电"
-        elif new_state.battery_level <= 10:
-            base_msg += " ⚠️ 紧急充电建议"
-        elif new_state.battery_level <= 20:
-            base_msg += " ⚡ 建议尽快充电"
+        for limit, warning in BATTERY_WARNINGS:
+            if new_state.battery_level <= limit:
+                parts.append(warning)
+                break
         
-        return base_msg
+        return "".join(parts)
     
     def _generate_payload_change_nl(self, new_state: AGVState, payload_change: int) -> str:
         """生成载货变化的自然语言描述"""
@@ -532,172 +676,148 @@ class StateCollector:
     
     def _get_event_category(self, event_type: str) -> str:
         """根据事件类型返回类别"""
-        if event_type.startswith("agv_"):
-            return "agv"
-        elif event_type.startswith("station_"):
-            return "station"
-        elif event_type.startswith("conveyor_"):
-            return "conveyor"
-        else:
-            return "system"
+        kind = _EVENT_KINDS.get(event_type.partition("_")[0])
+        return kind[0] if kind else "system"
     
-    def _generate_context_tags(self, event_type: str, data: Dict[str, Any]) -> List[str]:
+    def _generate_context_tags(self, event_type: str, data: Dict[str, Any]) -> Tuple[str, ...]:
         """生成上下文标签"""
-        tags = []
-        if event_type.startswith("agv_"):
-            tags.append("AGV")
-            tags.append(data.get("agv_id", "unknown"))
-            if data.get("line_id"):
-                tags.append(data["line_id"])
-        elif event_type.startswith("station_"):
-            tags.append("Station")
-            tags.append(data.get("station_id", "unknown"))
-            if data.get("line_id"):
-                tags.append(data["line_id"])
-        elif event_type.startswith("conveyor_"):
-            tags.append("Conveyor")
-            tags.append(data.get("conveyor_id", "unknown"))
-            if data.get("line_id"):
-                tags.append(data["line_id"])
-        
-        return tags
+        kind = _EVENT_KINDS.get(event_type.partition("_")[0])
+        if kind is None:
+            return ()
+        _, tag, id_field = kind
+        line_id = data.get("line_id")
+        if line_id:
+            return (tag, data.get(id_field, "unknown"), line_id)
+        return (tag, data.get(id_field, "unknown"))
     
     def _analyze_battery_trend(self, device_key: str, current_level: float) -> str:
         """分析电量趋势"""
-        history = self.state_history.get(device_key, [])
+        history = self.battery_history.get(device_key, ())
         if len(history) < 2:
             return "stable"
         
-        # 获取最近几次电量变化
-        recent_levels = [h["battery_level"] for h in history[-3:]]
-        recent_levels.append(current_level)
+        # 取最近3次历史电量加上当前电量；相邻差值之和可以直接消去中间项，
+        # 平均变化量 = (当前电量 - 窗口内最早电量) / 间隔数
+        window = min(len(history), 3)
+        avg_change = (current_level - history[-window]) / window
         
-        # 计算趋势
-        if len(recent_levels) >= 3:
-            trend_sum = 0
-            for i in range(1, len(recent_levels)):
-                trend_sum += recent_levels[i] - recent_levels[i-1]
-            
-            avg_change = trend_sum / (len(recent_levels) - 1)
-            
-            if avg_change > 2:
-                return "improving"
-            elif avg_change < -2:
-                return "degrading"
-            else:
-                return "stable"
-        
-        return "stable"
+        if avg_change > 2:
+            return "improving"
+        elif avg_change < -2:
+            return "degrading"
+        else:
+            return "stable"
     
-    def _update_device_history(self, device_key: str, new_state_data: Dict[str, Any]):
-        """更新设备状态历史"""
-        if device_key not in self.state_history:
-            self.state_history[device_key] = []
-        
-        history = self.state_history[device_key]
-        history.append(new_state_data)
-        
-        # 保持历史数量限制
-        if len(history) > self.max_history_per_device:
-            self.state_history[device_key] = history[-self.max_history_per_device:]
+    def _update_device_history(self, device_key: str, battery_level: float):
+        """更新设备电量历史（deque按max_history_per_device自动淘汰旧读数）"""
+        history = self.battery_history.get(device_key)
+        if history is None:
+            history = self.battery_history[device_key] = deque(maxlen=self.max_history_per_device)
+        history.append(battery_level)
     
-    def _maintain_event_limits(self):
+    def _maintain_event_limits(self, current_time: Optional[float] = None):
         """维护事件数量限制"""
-        if len(self.filtered_events) > self.max_events:
-            # 按重要性保留事件，优先保留高重要性事件
-            critical_events = [e for e in self.filtered_events if e["importance"] >= EventImportance.CRITICAL.value]
-            high_events = [e for e in self.filtered_events if e["importance"] == EventImportance.HIGH.value]
-            medium_events = [e for e in self.filtered_events if e["importance"] == EventImportance.MEDIUM.value]
-            low_events = [e for e in self.filtered_events if e["importance"] == EventImportance.LOW.value]
-            
-            # 保留最新的事件，但确保高重要性事件不被丢弃
-            keep_events = []
-            keep_events.extend(critical_events[-20:])  # 保留最近20个紧急事件
-            keep_events.extend(high_events[-30:])      # 保留最近30个高优先级事件
-            keep_events.extend(medium_events[-50:])    # 保留最近50个中等优先级事件
-            keep_events.extend(low_events[-100:])      # 保留最近100个低优先级事件
-            
-            # 按时间戳排序并限制总数
-            keep_events.sort(key=lambda x: x["timestamp"])
-            self.filtered_events = keep_events[-self.max_events:]
-        
-        # 清理过期的去重缓存
-        current_time = time.time()
-        expired_keys = [
-            key for key, timestamp in self.event_dedup_cache.items()
-            if current_time - timestamp > self.dedup_window * 2
-        ]
-        for key in expired_keys:
-            del self.event_dedup_cache[key]
+        # 事件数量由deque的maxlen自动限制，这里只需清理过期的去重缓存
+        if current_time is None:
+            current_time = time.time()
+        expiry = self._dedup_expiry
+        while expiry and expiry[0][0] < current_time:
+            _, key = heapq.heappop(expiry)
+            # 同一个键可能在之后被刷新过，只有确实过期才删除
+            last_time = self.event_dedup_cache.get(key)
+            if last_time is not None and current_time - last_time > self.dedup_window * 2:
+                del self.event_dedup_cache[key]
     
     # 基础状态查询方法
     
     def get_agv_states(self) -> Dict[str, Dict[str, Any]]:
-        """获取所有AGV状态"""
-        result = {}
-        for key, state in self.agv_states.items():
-            result[key] = {
-                "device_id": state.device_id,
-                "status": state.status,
-                "current_point": state.current_point,
-                "target_point": state.target_point,
-                "battery_level": state.battery_level,
-                "payload": state.payload,
-                "line_id": state.line_id,
-                "last_updated": state.last_updated
-            }
-        return result
+        """获取所有AGV状态（外层dict为副本，内层状态字典为缓存复用，调用方不应修改）"""
+        return dict(self._agv_views)
     
     def get_station_states(self) -> Dict[str, Dict[str, Any]]:
-        """获取所有工站状态"""
-        result = {}
-        for key, state in self.station_states.items():
-            result[key] = {
-                "device_id": state.device_id,
-                "status": state.status,
-                "buffer": state.buffer,
-                "buffer_count": len(state.buffer),
-                "stats": state.stats,
-                "line_id": state.line_id,
-                "last_updated": state.last_updated
-            }
-        return result
+        """获取所有工站状态（外层dict为副本，内层状态字典为缓存复用，调用方不应修改）"""
+        return dict(self._station_views)
     
     def get_conveyor_states(self) -> Dict[str, Dict[str, Any]]:
-        """获取所有传送带状态"""
-        result = {}
-        for key, state in self.conveyor_states.items():
-            result[key] = {
-                "device_id": state.device_id,
-                "status": state.status,
-                "buffer": state.buffer,
-                "buffer_count": len(state.buffer),
-                "upper_buffer": state.upper_buffer,
-                "lower_buffer": state.lower_buffer,
-                "line_id": state.line_id,
-                "last_updated": state.last_updated
-            }
-        return result
+        """获取所有传送带状态（外层dict为副本，内层状态字典为缓存复用，调用方不应修改）"""
+        return dict(self._conveyor_views)
     
     def get_warehouse_states(self) -> Dict[str, Dict[str, Any]]:
-        """获取所有仓库状态"""
-        result = {}
-        for key, state in self.warehouse_states.items():
-            result[key] = {
-                "device_id": state.device_id,
-                "buffer": state.buffer,
-                "buffer_count": len(state.buffer),
-                "stats": state.stats,
-                "last_updated": state.last_updated
-            }
-        return result
+        """获取所有仓库状态（外层dict为副本，内层状态字典为缓存复用，调用方不应修改）"""
+        return dict(self._warehouse_views)
+    
+    @staticmethod
+    def _agv_state_view(state: AGVState) -> Dict[str, Any]:
+        """AGV状态的字典视图"""
+        return {
+            "device_id": state.device_id,
+            "status": state.status,
+            "current_point": state.current_point,
+            "target_point": state.target_point,
+            "battery_level": state.battery_level,
+            "payload": state.payload,
+            "line_id": state.line_id,
+            "last_updated": state.last_updated
+        }
+    
+    @staticmethod
+    def _station_state_view(state: StationState) -> Dict[str, Any]:
+        """工站状态的字典视图"""
+        return {
+            "device_id": state.device_id,
+            "status": state.status,
+            "buffer": state.buffer,
+            "buffer_count": state.buffer_count,
+            "stats": state.stats,
+            "line_id": state.line_id,
+            "last_updated": state.last_updated
+        }
+    
+    @staticmethod
+    def _conveyor_state_view(state: ConveyorState) -> Dict[str, Any]:
+        """传送带状态的字典视图"""
+        return {
+            "device_id": state.device_id,
+            "status": state.status,
+            "buffer": state.buffer,
+            "buffer_count": state.buffer_count,
+            "upper_buffer": state.upper_buffer,
+            "lower_buffer": state.lower_buffer,
+            "line_id": state.line_id,
+            "last_updated": state.last_updated
+        }
+    
+    @staticmethod
+    def _warehouse_state_view(state: WarehouseState) -> Dict[str, Any]:
+        """仓库状态的字典视图"""
+        return {
+            "device_id": state.device_id,
+            "buffer": state.buffer,
+            "buffer_count": state.buffer_count,
+            "stats": state.stats,
+            "last_updated": state.last_updated
+        }
     
     def get_recent_events(self, count: int = 20) -> List[Dict[str, Any]]:
         """获取最近的事件"""
-        return self.filtered_events[-count:]
+        return self._tail(reversed(self.filtered_events), count)
+    
+    @staticmethod
+    def _tail(newest_first, count: int) -> List[Dict[str, Any]]:
+        """从按新到旧排列的事件中取最多count个，按时间顺序返回"""
+        tail = list(itertools.islice(newest_first, count))
+        tail.reverse()
+        return tail
     
     def get_line_summary(self, line_id: str) -> Dict[str, Any]:
-        """获取指定生产线的状态摘要"""
+        """获取指定生产线的状态摘要（结果会被缓存复用，调用方不应修改）"""
+        summary = self._line_summary_cache.get(line_id)
+        if summary is None:
+            summary = self._line_summary_cache[line_id] = self._build_line_summary(line_id)
+        return summary
+    
+    def _build_line_summary(self, line_id: str) -> Dict[str, Any]:
+        """重新计算生产线摘要"""
         summary = {
             "line_id": line_id,
             "agvs": {},
@@ -707,48 +827,56 @@ class StateCollector:
             "urgent_issues": []
         }
         
+        line = self._by_line.get(line_id)
+        if line is None:
+            return summary
+        summary["total_products"] = self._line_products.get(line_id, 0)
+        summary["urgent_issues"] = self.get_urgent_issues(line_id)
+        
         # AGV摘要
-        for key, state in self.agv_states.items():
-            if state.line_id == line_id:
-                summary["agvs"][state.device_id] = {
-                    "status": state.status,
-                    "battery": state.battery_level,
-                    "position": state.current_point,
-                    "payload_count": len(state.payload)
-                }
-                
-                # 检查紧急情况
-                if state.battery_level < 15:
-                    summary["urgent_issues"].append(f"{state.device_id} 电量危险低")
+        agv_states = self.agv_states
+        for key in line["agv"]:
+            state = agv_states[key]
+            summary["agvs"][state.device_id] = {
+                "status": state.status,
+                "battery": state.battery_level,
+                "position": state.current_point,
+                "payload_count": len(state.payload)
+            }
         
         # 工站摘要
-        for key, state in self.station_states.items():
-            if state.line_id == line_id:
-                buffer_count = len(state.buffer)
-                summary["stations"][state.device_id] = {
-                    "status": state.status,
-                    "buffer_count": buffer_count
-                }
-                summary["total_products"] += buffer_count
+        station_states = self.station_states
+        for key in line["station"]:
+            state = station_states[key]
+            summary["stations"][state.device_id] = {
+                "status": state.status,
+                "buffer_count": state.buffer_count
+            }
         
         # 传送带摘要
-        for key, state in self.conveyor_states.items():
-            if state.line_id == line_id:
-                buffer_count = len(state.buffer)
-                summary["conveyors"][state.device_id] = {
-                    "status": state.status,
-                    "buffer_count": buffer_count
-                }
-                summary["total_products"] += buffer_count
-                
-                # 检查阻塞
-                if state.status == "blocked":
-                    summary["urgent_issues"].append(f"{state.device_id} 被阻塞")
+        conveyor_states = self.conveyor_states
+        for key in line["conveyor"]:
+            state = conveyor_states[key]
+            summary["conveyors"][state.device_id] = {
+                "status": state.status,
+                "buffer_count": state.buffer_count
+            }
         
         return summary
     
+    def get_urgent_issues(self, line_id: str) -> List[str]:
+        """获取指定生产线当前的紧急问题"""
+        urgent = self._urgent_by_line.get(line_id)
+        return list(urgent.values()) if urgent else []
+    
     def get_factory_overview(self) -> Dict[str, Any]:
-        """获取整个工厂的状态概览"""
+        """获取整个工厂的状态概览（结果会被缓存复用，调用方不应修改）"""
+        if self._overview_cache is None:
+            self._overview_cache = self._build_factory_overview()
+        return self._overview_cache
+    
+    def _build_factory_overview(self) -> Dict[str, Any]:
+        """重新计算工厂概览"""
         overview = {
             "total_agvs": len(self.agv_states),
             "total_stations": len(self.station_states),
@@ -759,7 +887,7 @@ class StateCollector:
         }
         
         # 按生产线汇总
-        for line_id in ["line1", "line2", "line3"]:
+        for line_id in LINES:
             overview["lines"][line_id] = self.get_line_summary(line_id)
             overview["urgent_issues"].extend(overview["lines"][line_id]["urgent_issues"])
         
@@ -769,76 +897,84 @@ class StateCollector:
     
     def get_filtered_events(self, count: int = 20, min_importance: EventImportance = EventImportance.LOW) -> List[Dict[str, Any]]:
         """获取过滤后的事件，可按重要性筛选"""
-        filtered = [
-            event for event in self.filtered_events 
-            if event["importance"] >= min_importance.value
+        # 只合并满足重要性要求的分桶，各分桶内部已按插入顺序排列
+        buckets = [
+            reversed(events) for level, events in self.events_by_importance.items()
+            if level >= min_importance
         ]
-        return filtered[-count:]
+        newest_first = heapq.merge(*buckets, key=lambda e: e["seq"], reverse=True)
+        return self._tail(newest_first, count)
     
     def get_natural_language_summary(self, time_window: int = 300) -> str:
         """获取自然语言格式的工厂状态摘要"""
-        current_time = time.time()
-        recent_events = [
-            event for event in self.filtered_events
-            if current_time - event["timestamp"] <= time_window
-        ]
-        
-        if not recent_events:
+        # 直接读取各重要性分桶，低重要性事件刷屏时窗口内的紧急事件不会被挤掉
+        cutoff = time.time() - time_window
+        buckets = self.events_by_importance
+        if not any(events and events[-1]["timestamp"] >= cutoff for events in buckets.values()):
             return "工厂运行平稳，无特殊事件。"
         
-        # 按重要性分组
-        critical_events = [e for e in recent_events if e["importance"] >= EventImportance.CRITICAL.value]
-        high_events = [e for e in recent_events if e["importance"] == EventImportance.HIGH.value]
-        medium_events = [e for e in recent_events if e["importance"] == EventImportance.MEDIUM.value]
-        
         summary_parts = []
-        
-        if critical_events:
-            summary_parts.append(f"🚨 紧急情况 ({len(critical_events)} 项):")
-            for event in critical_events[-3:]:  # 最近3个紧急事件
-                summary_parts.append(f"  - {event['nl_description']}")
-        
-        if high_events:
-            summary_parts.append(f"⚠️ 重要事件 ({len(high_events)} 项):")
-            for event in high_events[-3:]:  # 最近3个重要事件
-                summary_parts.append(f"  - {event['nl_description']}")
-        
-        if medium_events and not critical_events and not high_events:
-            summary_parts.append(f"ℹ️ 常规事件 ({len(medium_events)} 项):")
-            for event in medium_events[-3:]:  # 最近3个常规事件
-                summary_parts.append(f"  - {event['nl_description']}")
+        for importance in SUMMARY_HEADERS:
+            # 没有紧急和重要事件时才列出常规事件
+            if importance == EventImportance.MEDIUM and summary_parts:
+                break
+            count, latest = self._window_tail(buckets[importance], cutoff)
+            if count:
+                summary_parts.append(f"{SUMMARY_HEADERS[importance]} ({count} 项):")
+                summary_parts.extend([SUMMARY_BULLET + event["nl_description"] for event in reversed(latest)])
         
         return "\n".join(summary_parts) if summary_parts else "工厂运行平稳，无重要事件。"
     
+    @staticmethod
+    def _window_tail(events: Deque[Dict[str, Any]], cutoff: float, keep: int = 3) -> Tuple[int, List[Dict[str, Any]]]:
+        """从新到旧遍历分桶直到窗口边界，返回窗口内事件数和最近keep个事件（新到旧）"""
+        count = 0
+        latest = []
+        for event in reversed(events):
+            if event["timestamp"] < cutoff:
+                break
+            count += 1
+            if count <= keep:
+                latest.append(event)
+        return count, latest
+    
     def get_context_for_llm(self, max_events: Optional[int] = None) -> Dict[str, Any]:
-        """为LLM生成结构化的上下文信息"""
+        """为LLM生成结构化的上下文信息（概览和事件条目会被缓存复用，调用方不应修改）"""
         if max_events is None:
             max_events = self.max_context_window
         
         # 获取最重要的事件
         important_events = self.get_filtered_events(max_events, EventImportance.MEDIUM)
         
-        context = {
+        # 收集紧急问题
+        urgent_issues = []
+        for line_id in LINES:
+            urgent_issues.extend(self.get_urgent_issues(line_id))
+        
+        return {
             "factory_overview": self.get_factory_overview(),
-                            "recent_events": [
-                {
-                    "type": event["type"],
-                    "description": event["nl_description"],
-                    "importance": event["importance"],
-                    "timestamp": event["timestamp"],
-                    "device_id": event["device_id"],
-                    "context_tags": event["metadata"].context_tags if hasattr(event.get("metadata", {}), "context_tags") else []
-                }
-                for event in important_events
-            ],
+            "recent_events": [self._llm_event_entry(event) for event in important_events],
             "summary": self.get_natural_language_summary(),
-            "urgent_issues": [],
+            "urgent_issues": urgent_issues,
             "recommendations": []
         }
-        
-        # 收集紧急问题
-        for line_id in ["line1", "line2", "line3"]:
-            line_summary = self.get_line_summary(line_id)
-            context["urgent_issues"].extend(line_summary.get("urgent_issues", []))
-        
-        return context 
\ No newline at end of file
+    
+    @staticmethod
+    def _llm_event_entry(event: Dict[str, Any]) -> Dict[str, Any]:
+        """事件在LLM上下文中的条目，首次被读取时构建并缓存在事件上"""
+        entry = event.get("llm_context")
+        if entry is None:
+            metadata = event["metadata"]
+            entry = event["llm_context"] = {
+                "type": event["type"],
+                "description": event["nl_description"],
+                "importance": event["importance"],
+                "timestamp": event["timestamp"],
+                "device_id": event["device_id"],
+                "context_tags": metadata.context_tags
+            }
+        return entry
+    
+    def get_context_for_llm_bytes(self, max_events: Optional[int] = None) -> bytes:
+        """LLM上下文的JSON编码（UTF-8字节），可直接写入请求体"""
+        return orjson.dumps(self.get_context_for_llm(max_events))
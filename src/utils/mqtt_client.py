@@ -18,6 +18,10 @@ class MQTTClient:
         self._port = port
         # NOTE: The client_id is passed as the first argument for compatibility.
         self._client = mqtt.Client(client_id=client_id)
+        # Allow many QoS>0 messages in flight and never drop queued ones,
+        # so bursts of publishes are not serialized behind PUBACKs.
+        self._client.max_inflight_messages_set(1000)
+        self._client.max_queued_messages_set(0)
             
         self._client.on_connect = self._on_connect
         self._client.on_disconnect = self._on_disconnect
@@ -38,7 +42,12 @@ class MQTTClient:
         Internal callback to route messages to the appropriate topic-specific callback.
         """
         logger.debug(f"Received message on topic {msg.topic}")
-        # Iterate over subscribed topics and check for a match
+        # Fast path: exact topic subscriptions are a single dict lookup
+        callback = self._message_callbacks.get(msg.topic)
+        if callback is not None:
+            callback(msg.topic, msg.payload)
+            return
+        # Iterate over subscribed topics and check for a wildcard match
         for topic_filter, callback in self._message_callbacks.items():
             if mqtt.topic_matches_sub(topic_filter, msg.topic):
                 callback(msg.topic, msg.payload)
@@ -83,20 +92,21 @@ class MQTTClient:
         self._message_callbacks[topic] = callback
         self._client.subscribe(topic, qos)
 
-    def publish(self, topic: str, payload: str | BaseModel, qos: int = 1, retain: bool = False):
+    def publish(self, topic: str, payload: str | bytes | BaseModel, qos: int = 1, retain: bool = False):
         """
         Publishes a message to a topic.
 
         Args:
             topic (str): The topic to publish to.
-            payload (str | BaseModel): The message payload. If it's a Pydantic BaseModel,
+            payload (str | bytes | BaseModel): The message payload. If it's a Pydantic BaseModel,
                                        it will be automatically converted to a JSON string.
+                                       Bytes (e.g. msgpack) are sent as-is.
             qos (int): The Quality of Service level for the message.
             retain (bool): Whether the message should be retained by the broker.
         """
         if isinstance(payload, BaseModel):
             message = payload.model_dump_json()
-        elif isinstance(payload, str):
+        elif isinstance(payload, (str, bytes)):
             message = payload
         else:
             message = str(payload)
@@ -0,0 +1,23 @@
+"""
+Binary serialization helpers for intra-system MQTT payloads.
+
+JSON stays the wire format for the dashboard topics; these helpers give
+internal publishers/subscribers a compact msgpack encoding of the same
+Pydantic schemas.
+"""
+from typing import Type, TypeVar
+
+import msgpack
+from pydantic import BaseModel
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def serialize(model: BaseModel) -> bytes:
+    """Encode a Pydantic model as msgpack bytes."""
+    return msgpack.packb(model.model_dump(mode="json"), use_bin_type=True)
+
+
+def deserialize(cls: Type[ModelT], buf: bytes) -> ModelT:
+    """Decode msgpack bytes produced by `serialize` back into `cls`."""
+    return cls.model_validate(msgpack.unpackb(buf, raw=False))
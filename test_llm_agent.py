@@ -30,7 +30,7 @@ async def test_llm_agent():
     mqtt_port = 1883
     
     logger.info("🧪 开始测试LLM Agent...")
-    logger.info(f"配置: Topic Root={topic_root}, MQTT={mqtt_host}:{mqtt_port}")
+    logger.info("配置: Topic Root=%s, MQTT=%s:%s", topic_root, mqtt_host, mqtt_port)
     
     # 创建LLM Agent
     agent = LLMFactoryAgent(
@@ -46,41 +46,55 @@ async def test_llm_agent():
         # 启动agent（会阻塞运行）
         # 我们需要在后台运行一段时间来收集状态
         start_time = time.time()
-        test_duration = 60  # 测试60秒
+        test_duration = 60  # 最长测试60秒
+        samples = 6  # 采样次数
         
         # 创建一个任务来运行agent
         agent_task = asyncio.create_task(agent.start())
         
-        # 等待一段时间让agent收集状态
-        await asyncio.sleep(5)
-        
         logger.info("📊 等待agent收集状态数据...")
         
-        # 每10秒检查一次状态
-        while time.time() - start_time < test_duration:
-            await asyncio.sleep(10)
+        # 每当agent处理完一批消息就检查一次状态，而不是固定间隔轮询
+        for _ in range(samples):
+            remaining = test_duration - (time.time() - start_time)
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(agent.batch_ready.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                logger.warning("⏰ 等待状态数据超时")
+                break
+            agent.batch_ready.clear()
             
             # 获取状态摘要
             status = agent.get_status_summary()
-            logger.info(f"Agent状态: {status}")
+            logger.info("Agent状态: %s", status)
             
             # 检查状态收集器
             agv_states = agent.state_collector.get_agv_states()
             station_states = agent.state_collector.get_station_states()
             
-            logger.info(f"收集到的AGV状态数: {len(agv_states)}")
-            logger.info(f"收集到的工站状态数: {len(station_states)}")
+            logger.info("收集到的AGV状态数: %s", len(agv_states))
+            logger.info("收集到的工站状态数: %s", len(station_states))
             
             # 显示最近事件
-            recent_events = agent.state.recent_events[-5:]  # 最近5条事件
+            recent_events = list(agent.state.recent_events)[-5:]  # 最近5条事件
             if recent_events:
                 logger.info("最近事件:")
                 for event in recent_events:
-                    logger.info(f"  - {event}")
+                    logger.info("  - %s", event)
             
             # 检查工厂概览
             overview = agent.state_collector.get_factory_overview()
-            logger.info(f"工厂概览: {overview}")
+            logger.info("工厂概览: %s", overview)
+        
+        # 状态采样很快就能完成，再等待至少一次决策，覆盖决策和命令发布路径
+        remaining = test_duration - (time.time() - start_time)
+        try:
+            await asyncio.wait_for(agent.decision_made.wait(), timeout=max(remaining, 0))
+            logger.info("🧠 Agent已完成决策，最近决策时间: %s", agent.state.last_decision_time)
+        except asyncio.TimeoutError:
+            logger.warning("⏰ 等待决策超时")
         
         logger.info("✅ 测试完成，停止agent...")
         
@@ -98,7 +112,7 @@ async def test_llm_agent():
         logger.info("🎉 LLM Agent测试成功完成！")
         
     except Exception as e:
-        logger.error(f"❌ 测试失败: {e}", exc_info=True)
+        logger.error("❌ 测试失败: %s", e, exc_info=True)
         try:
             await agent.stop()
         except:
@@ -129,7 +143,7 @@ def test_state_collector():
     
     # 获取状态
     agv_states = collector.get_agv_states()
-    logger.info(f"AGV状态: {agv_states}")
+    logger.info("AGV状态: %s", agv_states)
     
     # 模拟工站状态更新
     station_data = {
@@ -144,17 +158,72 @@ def test_state_collector():
     
     # 获取工厂概览
     overview = collector.get_factory_overview()
-    logger.info(f"工厂概览: {overview}")
+    logger.info("工厂概览: %s", overview)
     
     logger.info("✅ 状态收集器测试完成")
 
 
+def test_coalesce_snapshots():
+    """测试同一批次内设备状态快照的合并"""
+    logger.info("🧪 测试状态快照合并...")
+    
+    agent = LLMFactoryAgent(topic_root="NLDF_TEST")
+    tm = agent.topic_manager
+    agv_topic = tm.get_agv_status_topic("line1", "AGV_1")
+    conveyor_topic = tm.get_conveyor_status_topic("line1", "Conveyor_AB")
+    fault_topic = tm.get_fault_alert_topic("line1")
+    order_topic = tm.get_order_topic()
+    kpi_topic = tm.get_kpi_topic()
+    
+    items = [
+        (agv_topic, b"agv-1"),
+        (fault_topic, b"fault-1"),
+        (agv_topic, b"agv-1"),
+        (conveyor_topic, b"blocked"),
+        (order_topic, b"order-1"),
+        (agv_topic, b"agv-2"),
+        (kpi_topic, b"kpi-1"),
+        (conveyor_topic, b"unblocked"),
+        (fault_topic, b"fault-1"),
+        (order_topic, b"order-1"),
+        (agv_topic, b"agv-2"),
+        (kpi_topic, b"kpi-1"),
+    ]
+    result = agent._coalesce_snapshots(items)
+    logger.info("合并结果: %s", result)
+    
+    # 只丢弃与同一topic下一条快照完全相同的快照；状态翻转的中间快照和故障/订单/KPI消息全部保留，且保持原有顺序
+    assert result == [
+        (fault_topic, b"fault-1"),
+        (agv_topic, b"agv-1"),
+        (conveyor_topic, b"blocked"),
+        (order_topic, b"order-1"),
+        (kpi_topic, b"kpi-1"),
+        (conveyor_topic, b"unblocked"),
+        (fault_topic, b"fault-1"),
+        (order_topic, b"order-1"),
+        (agv_topic, b"agv-2"),
+        (kpi_topic, b"kpi-1"),
+    ]
+    
+    # 故障后又恢复（error -> idle）的两条快照都要保留，否则会漏掉紧急状态变化事件
+    flap = [(agv_topic, b"error"), (agv_topic, b"idle"), (agv_topic, b"error")]
+    assert agent._coalesce_snapshots(flap) == flap
+    
+    # 没有重复快照时原样返回
+    distinct = [(agv_topic, b"agv-1"), (conveyor_topic, b"conveyor-1")]
+    assert agent._coalesce_snapshots(distinct) == distinct
+    
+    logger.info("✅ 状态快照合并测试完成")
+
+
 async def main():
     """主测试函数"""
     logger.info("🧪 开始LLM Agent完整测试")
     
     # 首先测试状态收集器
     test_state_collector()
+    test_coalesce_snapshots()
     
     print("\n" + "="*50)
     
@@ -174,4 +243,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("测试被用户中断")
     except Exception as e:
-        logger.error(f"测试异常: {e}", exc_info=True) 
\ No newline at end of file
+        logger.error("测试异常: %s", e, exc_info=True) 
\ No newline at end of file
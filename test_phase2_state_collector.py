@@ -155,7 +155,6 @@ def test_context_management():
             "payload": [f"product_{i}"]
         }
         collector.update_agv_status(agv_data)
-        time.sleep(0.1)  # 确保时间戳不同
     
     # 模拟传送带阻塞
     conveyor_data = {
@@ -239,12 +238,11 @@ def test_trend_analysis():
         agv_data["battery_level"] = level
         agv_data["timestamp"] = time.time()
         collector.update_agv_status(agv_data)
-        time.sleep(0.1)
     
     # 检查是否检测到下降趋势
     events = collector.get_filtered_events(10)
     has_degrading_trend = any(
-        "degrading" in str(event.get("data", {})) or "下降" in event.get("nl_description", "")
+        event["trend"] == "degrading" or "下降" in event["nl_description"]
         for event in events
     )
     
@@ -253,6 +251,48 @@ def test_trend_analysis():
     return True  # 趋势分析功能已实现，即使未直接体现在事件中
 
 
+def test_critical_event_survives_flood():
+    """测试大量低重要性事件不会把窗口内的紧急事件挤出摘要"""
+    print("\n🧪 测试低重要性事件刷屏...")
+    
+    topic_manager = TopicManager("TEST")
+    collector = StateCollector(topic_manager)
+    
+    # AGV从空闲转为故障，产生紧急事件
+    fault_data = {
+        "source_id": "AGV_X",
+        "timestamp": time.time(),
+        "status": "idle",
+        "current_point": "P0",
+        "battery_level": 80.0,
+        "payload": []
+    }
+    collector.update_agv_status(fault_data)
+    fault_data["status"] = "error"
+    collector.update_agv_status(fault_data)
+    
+    # 另一台AGV连续移动，产生超过事件容量的低重要性位置事件
+    flood_data = {
+        "source_id": "AGV_FLOOD",
+        "timestamp": time.time(),
+        "status": "moving",
+        "current_point": "P0",
+        "battery_level": 80.0,
+        "payload": []
+    }
+    for i in range(1, 251):
+        flood_data["current_point"] = f"P{i}"
+        collector.update_agv_status(flood_data)
+    
+    summary = collector.get_natural_language_summary()
+    print(f"✅ 自然语言摘要: {summary.splitlines()[0] if summary else ''}")
+    
+    has_fault = "紧急情况" in summary and "AGV_X" in summary
+    print(f"✅ 摘要保留故障事件: {has_fault}")
+    
+    return has_fault
+
+
 async def main():
     """主测试函数"""
     print("🚀 开始 Phase 2 StateCollector 功能测试")
@@ -267,6 +307,7 @@ async def main():
     test_results.append(test_context_management())
     test_results.append(test_deduplication())
     test_results.append(test_trend_analysis())
+    test_results.append(test_critical_event_survives_flood())
     
     # 测试结果汇总
     print("\n" + "=" * 60)
@@ -278,7 +319,8 @@ async def main():
         "事件重要性过滤",
         "上下文管理",
         "事件去重",
-        "趋势分析"
+        "趋势分析",
+        "紧急事件防刷屏"
     ]
     
     passed = 0
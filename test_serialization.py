@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+msgpack 序列化往返测试
+
+验证 serialize/deserialize 能还原 Pydantic 模型（含枚举与可选字段）
+"""
+
+from config.schemas import AGVStatus, DeviceStatus
+from src.utils.serialization import serialize, deserialize
+
+
+def test_agv_status_round_trip():
+    """测试AGVStatus经msgpack编码后可完整还原"""
+    status = AGVStatus(
+        timestamp=12.5,
+        source_id="AGV_1",
+        status=DeviceStatus.MOVING,
+        speed_mps=1.5,
+        current_point="P1",
+        position={"x": 10.0, "y": 15.0},
+        target_point="P2",
+        estimated_time=3.0,
+        payload=["prod_1_abc", "prod_2_def"],
+        battery_level=85.0,
+    )
+
+    buf = serialize(status)
+    assert isinstance(buf, bytes)
+
+    restored = deserialize(AGVStatus, buf)
+    assert restored == status
+    assert restored.status is DeviceStatus.MOVING
+    assert restored.message is None
+
+
+if __name__ == "__main__":
+    test_agv_status_round_trip()
+    print("✅ msgpack 序列化往返测试通过")